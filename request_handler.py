@@ -1,542 +1,975 @@
-import os
-import re
-import logging
-from difflib import get_close_matches
-from ibm_watsonx_ai.foundation_models import ModelInference
-from mcp_mysql import mysql_query, get_table_schema, get_all_tables_in_db
-
-# Initialize IBM Watsonx AI Model once
-class WatsonxClient:
-    def __init__(self):
-        self.api_key = os.getenv("WATSONX_API_KEY")
-        self.model_id = os.getenv("WATSONX_MODEL_ID")
-        self.project_id = os.getenv("WATSONX_PROJECT_ID")
-        self.credentials = {
-            "apikey": self.api_key,
-            "url": "https://us-south.ml.cloud.ibm.com"
-        }
-        self.inference = ModelInference(
-            model_id=self.model_id, 
-            credentials=self.credentials, 
-            project_id=self.project_id
-        )
-
-    def generate_text(self, prompt):
-        response = self.inference.generate(prompt, params={"max_new_tokens": 512})
-        return response['results'][0]['generated_text'].strip()
-
-watsonx_client = WatsonxClient()
-
-
-def fetch_all_databases():
-    """
-    Fetches the list of all database names from MySQL server.
-    Returns list like ['information_schema', 'mysql', 'PO_APP', 'Task', ...]
-    """
-    try:
-        result = mysql_query("SHOW DATABASES;")
-        if result and "rows" in result:
-            print([row[0] for row in result["rows"]],"This is my DatabaseName")
-            return [row[0] for row in result["rows"]]
-    except Exception as e:
-        logging.error(f"Error fetching databases: {e}")
-    # Fallback to env default only if failed
-    return [os.getenv("MYSQL_DATABASE")]
-
-
-def detect_and_normalize_names(user_input, available_dbs):
-    """
-    This uses Watsonx LLM to identify and normalize database name, table name, and column names
-    based on user input and available databases/tables.
-
-    Returns a dict: {
-      "database": <exact_db_name>,
-      "table": <exact_table_name>,
-      "column": <exact_column_name or None>
-    }
-    """
-    # Step 1: For all available databases, fetch top tables (to limit prompt size)
-    db_tables = {}
-    for db in available_dbs:
-        try:
-            tables = get_all_tables_in_db(db)
-            db_tables[db] = tables
-        except Exception as e:
-            logging.warning(f"Could not fetch tables for DB {db}: {e}")
-            db_tables[db] = []
-
-    # Prepare a summarized schema description for prompt
-    schema_info_str = ""
-    for db, tables in db_tables.items():
-        schema_info_str += f"\nDatabase `{db}` has tables: {', '.join(tables)}"
-
-#     prompt = f"""
-# You are an expert SQL assistant.
-
-# User input:
-# \"\"\"{user_input}\"\"\"
-
-# Available database: Task
-# Available table in Task: Invoice_Data
-# Invoice_Data table columns: id, billing_organization_name, billing_address, billing_contact_information, billing_phone_number, billing_gst_number, billing_hsn_number, shipping_organization_name, shipping_address, shipping_contact_information, shipping_phone_number, shipping_gst_number, shipping_hsn_number, invoice_number, invoice_date, due_date, total_amount, subtotal, tax_amount, discount, po_number, currency, payment_terms, verification_status, file_path, extracted_at, created_at, updated_at, line_items, file_name
-
-# Please identify exactly:
-# - The database name (choose from "Task" or null if none specified)
-# - The main table name (choose from "Invoice_Data" or null if none specified)
-# - The exact column name in Invoice_Data if mentioned; otherwise null
-
-# If the user input is ambiguous or does not explicitly refer to any, return null for those fields.
-
-# Return ONLY this JSON dictionary with keys "database", "table", and "column", for example:
-
-# {{
-#   "database": ...,
-#   "table": ...,
-#   "column": ...
-# }}
-# """
-
-    prompt = f"""
-You are an expert SQL assistant specialized in understanding user queries and mapping them exactly to database schema elements.
-
-User input:
-\"\"\"{user_input}\"\"\"
-
-Schema information for matching:
-
-- Available database: `Task`
-- Available table in `Task`: `Invoice_Data`
-- Columns in `Invoice_Data`:
-  id, billing_organization_name, billing_address, billing_contact_information, billing_phone_number,
-  billing_gst_number, billing_hsn_number, shipping_organization_name, shipping_address,
-  shipping_contact_information, shipping_phone_number, shipping_gst_number, billing_hsn_number,
-  invoice_number, invoice_date, due_date, total_amount, subtotal, tax_amount, discount, po_number,
-  currency, payment_terms, verification_status, file_path, extracted_at, created_at,
-  updated_at, line_items, file_name
-
-Your task:
-
-- Analyze the user input and exactly identify if it explicitly mentions any of the following:
-  1. The database name (must be `Task` or `null`)
-  2. The main table name (must be `Invoice_Data` or `null`)
-  3. An exact column name from the columns listed above (or `null` if none mentioned)
-
-- If the user input references synonyms or common terms related to columns (e.g., "total revenue" relates to `total_amount`), you may map accordingly only if the mention is clear.
-
-- If there is ambiguity or no explicit mention of any database, table, or column name, return `null` for those fields.
-
-Important:
-
-- Do NOT guess or invent names.
-- Only respond with the JSON dictionary below WITHOUT ANY additional text or explanation.
-
-Example output JSON:
-
-{{
-  "database": "Task",
-  "table": "Invoice_Data",
-  "column": "total_amount"
-}}
-
-If nothing matches explicitly, return:
-
-{{
-  "database": null,
-  "table": null,
-  "column": null
-}}
-"""
-
-
-
-    response = watsonx_client.generate_text(prompt)
-
-    logging.info(f"Name detection LLM response: {response}")
-
-    # Parse JSON out of response safely
-    import json
-    try:
-        detected = json.loads(response)
-    except Exception:
-        # Attempt to extract JSON substring naive fallback
-        try:
-            json_start = response.index("{")
-            json_end = response.rindex("}") + 1
-            detected = json.loads(response[json_start:json_end])
-        except Exception as e:
-            logging.error(f"Could not parse LLM JSON response: {e}")
-            detected = {"database": None, "table": None, "column": None}
-
-    return detected
-
-
-def build_full_sql_query(user_input, db_name, table_name, column_name=None):
-    """
-    Build a valid SQL query string by instructing Watsonx LLM
-    using exact database/table/column names previously predicted.
-    If column_name is given, build a query accordingly (for column info or aggregations).
-    If not, try to generate a sensible query for the input and known schema.
-    """
-    # Get columns info for given database & table to improve prompt
-    columns = []
-    if db_name and table_name:
-        columns = get_table_schema(db_name, table_name)
-
-    schema_info = ""
-    if columns:
-        schema_info = f"\nTable `{table_name}` columns: {', '.join(columns)}"
-
-#     prompt = f"""
-# You are an expert SQL generator.
-
-# The user wants to run a query on the database `{db_name}`, table `{table_name}`.
-
-# Columns in the table: {', '.join(columns)}{schema_info}
-
-# User input or question:
-# \"\"\"{user_input}\"\"\"
-
-# Instructions:
-# - Always generate a **valid MySQL query**.
-# - Use fully qualified table names like `{db_name}.{table_name}`.
-# - Use the exact column names from the table.
-# - Do not include explanations—only return the SQL query.
-# - If the user mentions "total revenue", interpret it as the `total_amount` column.
-# - if the user mention 'products' means this will be line_item description present in the line_item array.
-
-# Examples:
-
-# > User: Who are the top 5 customers by total amount?  
-# ```sql
-# SELECT org_name, SUM(CAST(total_amount AS FLOAT)) AS total_amount_sum
-# FROM Task.Invoice_Data
-# GROUP BY org_name
-# ORDER BY total_amount_sum DESC
-# LIMIT 5;
-# User: What are the invoices in March month?
-
- 
-# SELECT *
-# FROM Task.Invoice_Data
-# WHERE MONTH(invoice_date) = 3;
-# User: Total invoice amount of UNIWARE SYSTEMS PVT LTD organization?
-
- 
-# SELECT SUM(CAST(total_amount AS FLOAT))
-# FROM Task.Invoice_Data
-# WHERE org_name = 'UNIWARE SYSTEMS PVT LTD';
-# User: Show me the highest total amount invoice customer.
-
- 
-# SELECT org_name, invoice_number, total_amount
-# FROM Task.Invoice_Data
-# ORDER BY CAST(total_amount AS FLOAT) DESC
-# LIMIT 1;
-# User: Summarize the table
-# SELECT * FROM Task.Invoice_Data;
-# If the line_items column contains an array of JSON objects like:
-
-
-# [
-#  { {
-#     "s_no": 1,
-#     "description": "AMC of DELL EMC Data Domain 6300 – Renewal",
-#     "quantity": 1,
-#     "unit_price": 550000.00,
-#     "total_per_product": 550000.00
-#   },
-#   {
-#     "s_no": 2,
-#     "description": "Uniware Support for One Year – Uniware 8/5 On-Demand Remote Support",
-#     "quantity": 1,
-#     "unit_price": 40000.00,
-#     "total_per_product": 40000.00
-#   }
-# }
-#   ]
-
-
-# Example
-# "Which product appears in the most invoices?"
-
- 
-# SELECT 
-#   description AS product,
-#   COUNT(DISTINCT id) AS invoice_count
-# FROM Task.Invoice_Data,
-#   JSON_TABLE(
-#     line_items,
-#     '$[*]' COLUMNS (
-#       description VARCHAR(255) PATH '$.description'
-#     )
-#   ) AS items
-# GROUP BY description
-# ORDER BY invoice_count DESC
-# LIMIT 1;
-# "What is the total quantity sold for each product?
-
-# Based on these examples and rules, generate only the appropriate SQL query for the given user input.
-# """
-    prompt=f"""
-You are an expert SQL generator.
-
-The user wants to run a query on the database `{db_name}`, table `{table_name}`.
-
-Columns in the table: {', '.join(columns)}{schema_info}
-
-User input or question:
-\"\"\"{user_input}\"\"\"
-
-Instructions:
-- Always generate a **valid MySQL query**.
-- Use fully qualified table names like `{db_name}.{table_name}`.
-- Use the exact column names from the table.
-- Do not include explanations—only return the SQL query.
-- If the user mentions "total revenue" or "total amount", interpret it as the `total_amount` column.
-- If the user mentions "products" or "product", this refers to the `description` field inside the JSON array in the `line_items` column.
-
-Examples:
-
-> User: Who are the top 5 customers by total amount?  
-SELECT billing_organization_name, SUM(CAST(total_amount AS DECIMAL(18,2))) AS total_amount_sum
-FROM {db_name}.{table_name}
-GROUP BY billing_organization_name
-ORDER BY total_amount_sum DESC
-LIMIT 5;
-
- 
-
-> User: What are the invoices in March month?
-SELECT *
-FROM {db_name}.{table_name}
-WHERE MONTH(invoice_date) = 3;
-
-
-> User: Total invoice amount of UNIWARE SYSTEMS PVT LTD organization?
-SELECT SUM(CAST(total_amount AS DECIMAL(18,2)))
-FROM {db_name}.{table_name}
-WHERE billing_organization_name = 'UNIWARE SYSTEMS PVT LTD';
-
-
-> User: Show me the highest total amount invoice customer.
-SELECT billing_organization_name, invoice_number, total_amount
-FROM {db_name}.{table_name}
-ORDER BY CAST(total_amount AS DECIMAL(18,2)) DESC
-LIMIT 1;
-
-
-
-> User: Summarize the table
-SELECT * FROM {db_name}.{table_name};
-
-
-
-If the `line_items` column contains an array of JSON objects like:
-
-[
-{
-  {
-    "S.NO": 1,
-    "description": "AMC of DELL EMC Data Domain 6300 – Renewal",
-    "quantity": 1,
-    "unit_price": 550000.00,
-    "total_per_product": 550000.00
-  },
-  {
-    "S.NO": 2,
-    "description": "Uniware Support for One Year – Uniware 8/5 On-Demand Remote Support",
-    "quantity": 1,
-    "unit_price": 40000.00,
-    "total_per_product": 40000.00
-  }
-
-  }
-]
-
-Example:
-"Which product appears in the most invoices?"
-SELECT
-items.description AS product,
-COUNT(DISTINCT id) AS invoice_count
-FROM {db_name}.{table_name},
-JSON_TABLE(
-line_items,
-'$[*]' COLUMNS (
-description VARCHAR(255) PATH '$.description'
-)
-) AS items
-GROUP BY items.description
-ORDER BY invoice_count DESC
-LIMIT 1;
-
- 
-
-Example:
-"What is the total quantity sold for each product?"
-SELECT
-items.description AS product,
-SUM(CAST(items.quantity AS UNSIGNED)) AS total_quantity_sold
-FROM {db_name}.{table_name},
-JSON_TABLE(
-line_items,
-'$[*]' COLUMNS (
-description VARCHAR(255) PATH '$.description',
-quantity VARCHAR(50) PATH '$.quantity'
-)
-) AS items
-GROUP BY items.description
-ORDER BY total_quantity_sold DESC;
-
- 
-
-Based on these examples and rules, generate only the appropriate SQL query for the given user input.
-
-
-"""
-    if column_name:
-        prompt += f"\nThe user specifically mentioned a column `{column_name}` that may be in the query."
-
-    response = watsonx_client.generate_text(prompt)
-    logging.info(f"Generated SQL from LLM: {response}")
-
-    # Extract SQL (naive - look for SQL code or from first SQL keyword)
-    sql_query = extract_sql_from_llm_response(response)
-    print(sql_query,"This is my sql querrryyyyyyyyyyyy")
-    return sql_query
-
-
-def extract_sql_from_llm_response(response_text):
-    """
-    Extract SQL from the LLM response by locating code blocks or starting at SQL keywords.
-    """
-    import re
-    # Look for code block fenced by backticks
-    code_blocks = re.findall(r"``````", response_text, re.DOTALL | re.IGNORECASE)
-    if code_blocks:
-        return code_blocks[0].strip()
-    code_blocks = re.findall(r"``````", response_text, re.DOTALL | re.IGNORECASE)
-    if code_blocks:
-        return code_blocks[0].strip()
-
-    # Otherwise find first SQL keyword and return from there
-    sql_keywords = ['SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'SHOW', 'DESCRIBE', 'EXPLAIN']
-    pattern = re.compile("(" + "|".join(sql_keywords) + ")", re.IGNORECASE)
-    match = pattern.search(response_text)
-    if match:
-        print(response_text[match.start():].strip(),"if keywrd matchessssss")
-        return response_text[match.start():].strip()
-
-    # fallback: return full response
-    print(response_text.strip(),"response_text.strip()")
-    return response_text.strip()
-
-
-def extract_column_from_sql_error(error_msg):
-    """
-    Extract unknown column name from MySQL error message.
-    """
-    matches = re.findall(r"Unknown column '(.+?)' in", error_msg)
-    if matches:
-        return matches[0]
-    return None
-
-
-def fix_sql_query_column(sql, error_msg, db_name, table_name):
-    """
-    Attempt to fix SQL by replacing unknown column with closest matching column in actual schema.
-    """
-    invalid_col = extract_column_from_sql_error(error_msg)
-    if not invalid_col:
-        return None
-
-    columns = get_table_schema(db_name, table_name)
-    if not columns:
-        return None
-
-    matches = get_close_matches(invalid_col, columns, n=1, cutoff=0.6)
-    if not matches:
-        return None
-
-    corrected_col = matches[0]
-    fixed_sql = re.sub(re.escape(invalid_col), corrected_col, sql, flags=re.IGNORECASE)
-    print( "fixed_sql", fixed_sql)
-    return fixed_sql
-
-
-def handle_user_query(user_input):
-    """
-    Main entry point.
-
-    Logic:
-    1. Fetch all available databases.
-    2. Use LLM + database metadata to detect exact DB, table, column names from user input.
-    3. Generate fully qualified, exact SQL query.
-    4. Try executing query with MCP.
-    5. If error about unknown columns, auto-fix once.
-    6. Return results and diagnostic info.
-    """
-
-    logging.info(f"Received user input: {user_input}")
-
-    # Step 1: Fetch all databases dynamically
-    available_dbs = fetch_all_databases()
-
-    # Step 2: Detect exact database, table, and column names using LLM helper
-    detected = detect_and_normalize_names(user_input, available_dbs)
-    db_name = detected.get("database") or os.getenv("MYSQL_DATABASE")
-    # table_name = detected.get("table")
-    table_name = detected.get("table") or "Invoice_Data"
-    column_name = detected.get("column")
-
-    # Security fallback & logging
-    if db_name not in available_dbs:
-        logging.warning(f"Detected DB '{db_name}' not in available databases list; falling back to default")
-        db_name = os.getenv("MYSQL_DATABASE")
-
-    logging.info(f"Normalized names - DB: {db_name}, Table: {table_name}, Column: {column_name}")
-
-    # Step 3: Build SQL query with exact names
-    try:
-        sql_query = build_full_sql_query(user_input, db_name=db_name, table_name=table_name, column_name=column_name)
-    except Exception as e:
-        logging.error(f"Error generating SQL query: {e}")
-        return {"error": f"AI generation failed: {str(e)}"}
-
-    # Step 4: Try executing the query
-    try:
-        result = mysql_query(sql_query, db_name=db_name)
-        return {
-            "sql": sql_query,
-            "result": result,
-            "corrected": False,
-            "database": db_name,
-            "table": table_name,
-            "column": column_name
-        }
-    except Exception as exec_err:
-        error_msg = str(exec_err)
-        logging.warning(f"Query execution failed: {error_msg}")
-
-        # Step 5: Try to auto-fix unknown column errors once
-        fixed_sql = fix_sql_query_column(sql_query, error_msg, db_name, table_name)
-        if fixed_sql and fixed_sql != sql_query:
-            logging.info(f"Retrying with fixed SQL:\n{fixed_sql}")
-            try:
-                fixed_result = mysql_query(fixed_sql, db_name=db_name)
-                return {
-                    "sql": fixed_sql,
-                    "result": fixed_result,
-                    "corrected": True,
-                    "original_sql": sql_query,
-                    "database": db_name,
-                    "table": table_name,
-                    "column": column_name
-                }
-            except Exception as second_err:
-                logging.error(f"Execution failed even after fix: {second_err}")
-                return {"error": f"Execution failed after fix: {second_err}", "sql": fixed_sql}
-
-        # If no fix possible, return original error
-        print (f"Execution failed: {error_msg}")
-        print (f"Original SQL: {sql_query}")
-        return {"error": f"Query execution error: {error_msg}", "sql": sql_query}
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache, wraps
+from difflib import get_close_matches
+try:
+    # C++-backed Levenshtein - orders of magnitude faster than difflib's SequenceMatcher
+    from rapidfuzz import process as _rf_process, fuzz as _rf_fuzz
+except ImportError:
+    _rf_process = None
+try:
+    # Rust JSON parser, 2-5x faster than stdlib for the per-turn LLM responses
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+from ibm_watsonx_ai.foundation_models import ModelInference
+from mcp_mysql import mysql_query, get_table_schema
+
+logger = logging.getLogger(__name__)
+
+# Initialize IBM Watsonx AI Model once
+class WatsonxClient:
+    def __init__(self):
+        self.api_key = os.getenv("WATSONX_API_KEY")
+        self.model_id = os.getenv("WATSONX_MODEL_ID")
+        self.project_id = os.getenv("WATSONX_PROJECT_ID")
+        self.credentials = {
+            "apikey": self.api_key,
+            "url": "https://us-south.ml.cloud.ibm.com"
+        }
+        self.inference = ModelInference(
+            model_id=self.model_id,
+            credentials=self.credentials,
+            project_id=self.project_id
+        )
+
+    def generate_text(self, prompt, max_new_tokens=512):
+        response = self.inference.generate(prompt, params={"max_new_tokens": max_new_tokens})
+        return response['results'][0]['generated_text'].strip()
+
+watsonx_client = WatsonxClient()
+
+# Caching for repeat / near-repeat questions:
+# - name detection is memoized on the exact normalized user input
+# - generated SQL is cached on a "query skeleton" (entities/numbers/dates
+#   stripped out), so structurally identical questions reuse the SQL template
+# - executed results are cached per (sql, db) with a short TTL
+_WS_RE = re.compile(r"\s+")
+_SEMANTIC_VALUE_RE = re.compile(
+    r"('[^']*'|\"[^\"]*\")|(\d+)|"
+    r"\b(january|february|march|april|may|june|july|august|september|october|november|december)\b",
+    re.IGNORECASE
+)
+
+_SQL_TEMPLATE_CACHE = OrderedDict()
+_SQL_TEMPLATE_CACHE_MAX = 512
+
+_RESULT_CACHE = OrderedDict()
+_RESULT_CACHE_MAX = 128
+_RESULT_TTL = 60  # seconds
+
+# Both OrderedDict caches are mutated from concurrent Gradio worker threads;
+# plain dict ops race (expiry del after del -> KeyError, move_to_end after
+# eviction). The lru_cache-based caches are internally thread-safe already.
+_CACHE_LOCK = threading.Lock()
+
+
+def _normalize_input(user_input):
+    """Lowercase and collapse whitespace so trivially different inputs share a cache key."""
+    return _WS_RE.sub(" ", user_input.strip()).lower()
+
+
+def _query_skeleton(user_input):
+    """
+    Reduce the user input to a structural skeleton: quoted strings become '?',
+    digit runs become '#', month names become '<MONTH>'.
+
+    Returns (skeleton, values) where values are the concrete strings that were
+    stripped out, in order, so they can be substituted back into a cached SQL template.
+    """
+    collapsed = _WS_RE.sub(" ", user_input.strip())
+    values = []
+
+    def _repl(match):
+        values.append(match.group(0))
+        if match.group(1):
+            return "?"
+        if match.group(2):
+            return "#"
+        return "<MONTH>"
+
+    skeleton = _SEMANTIC_VALUE_RE.sub(_repl, collapsed).lower()
+    return skeleton, tuple(values)
+
+
+def _strip_value_quotes(value):
+    """Bare form of an extracted input value - quoted strings lose their quotes."""
+    return value.strip("'\"")
+
+
+def _templatize(text, values):
+    """
+    Replace each extracted input value in text with its {i} placeholder.
+    Matching always uses the quote-stripped form: it is a substring of the
+    quoted form, so SQL string literals keep their surrounding quotes in the
+    template, and bind parameters (which carry the bare value) match directly.
+    Formatting must therefore also use the stripped values - see _sql_from_cache.
+    Returns (template, indexes of values that were found).
+    """
+    template = text.replace("{", "{{").replace("}", "}}")
+    hits = set()
+    for i, value in enumerate(values):
+        candidate = _strip_value_quotes(value)
+        escaped = re.escape(candidate.replace("{", "{{").replace("}", "}}"))
+        if candidate.isdigit():
+            pattern = r"\b" + escaped + r"\b"
+        else:
+            pattern = escaped
+        template, n_subs = re.subn(pattern, "{%d}" % i, template, flags=re.IGNORECASE)
+        if n_subs:
+            hits.add(i)
+    return template, hits
+
+
+def _store_sql_template(skeleton, values, db_name, table_name, column_name, sql, params=()):
+    """
+    Turn a concrete generated (sql, params) pair into a template by replacing
+    the extracted input values with {0}, {1}, ... placeholders and cache it
+    under the skeleton. If any value cannot be located in the SQL or its params
+    we skip caching - substituting a later question's values back in would
+    silently return the wrong query.
+    """
+    sql_template, hits = _templatize(sql, values)
+    param_templates = []
+    for param in params:
+        param_template, param_hits = _templatize(str(param), values)
+        param_templates.append(param_template)
+        hits |= param_hits
+    if len(hits) != len(values):
+        logging.info(f"Skipping SQL template cache - not all input values found in generated SQL/params")
+        return
+    key = (skeleton, db_name, table_name, column_name)
+    with _CACHE_LOCK:
+        _SQL_TEMPLATE_CACHE[key] = (sql_template, tuple(param_templates), len(values))
+        _SQL_TEMPLATE_CACHE.move_to_end(key)
+        while len(_SQL_TEMPLATE_CACHE) > _SQL_TEMPLATE_CACHE_MAX:
+            _SQL_TEMPLATE_CACHE.popitem(last=False)
+
+
+def _sql_from_cache(skeleton, values, db_name, table_name, column_name):
+    """Return a concrete (sql, params) rebuilt from a cached template, or None on miss."""
+    key = (skeleton, db_name, table_name, column_name)
+    with _CACHE_LOCK:
+        entry = _SQL_TEMPLATE_CACHE.get(key)
+        if entry is not None:
+            _SQL_TEMPLATE_CACHE.move_to_end(key)
+    if entry is None:
+        return None
+    sql_template, param_templates, n_values = entry
+    if len(values) != n_values:
+        return None
+    # Templates were built against the quote-stripped values (see _templatize),
+    # so substitute the same form back - formatting with the raw quoted value
+    # would bake literal quote characters into the bind parameters
+    bare = tuple(_strip_value_quotes(v) for v in values)
+    return sql_template.format(*bare), tuple(pt.format(*bare) for pt in param_templates)
+
+
+def _result_from_cache(sql_query, db_name, params=()):
+    """Return a cached result set for (sql, params, db) if present and not expired."""
+    key = (sql_query, params, db_name)
+    with _CACHE_LOCK:
+        entry = _RESULT_CACHE.get(key)
+        if entry is None:
+            return None
+        ts, result = entry
+        if time.monotonic() - ts > _RESULT_TTL:
+            _RESULT_CACHE.pop(key, None)
+            return None
+        _RESULT_CACHE.move_to_end(key)
+    return result
+
+
+def _store_result(sql_query, db_name, result, params=()):
+    key = (sql_query, params, db_name)
+    with _CACHE_LOCK:
+        _RESULT_CACHE[key] = (time.monotonic(), result)
+        _RESULT_CACHE.move_to_end(key)
+        while len(_RESULT_CACHE) > _RESULT_CACHE_MAX:
+            _RESULT_CACHE.popitem(last=False)
+
+
+@lru_cache(maxsize=512)
+def _detect_cached(user_input_normalized, available_dbs):
+    """Memoized wrapper around detect_and_normalize_names (one LLM call saved per hit)."""
+    return detect_and_normalize_names(user_input_normalized, list(available_dbs))
+
+
+# Schema block for the name-detection prompt, built once at module load.
+# Keeping this static (rather than re-listing every DB and its tables per turn)
+# keeps the prompt small - Watsonx latency and cost grow with prompt tokens.
+_SCHEMA_PROMPT_FRAGMENT = """
+Schema information for matching:
+
+- Available database: `Task`
+- Available table in `Task`: `Invoice_Data`
+- Columns in `Invoice_Data`:
+  id, billing_organization_name, billing_address, billing_contact_information, billing_phone_number,
+  billing_gst_number, billing_hsn_number, shipping_organization_name, shipping_address,
+  shipping_contact_information, shipping_phone_number, shipping_gst_number, billing_hsn_number,
+  invoice_number, invoice_date, due_date, total_amount, subtotal, tax_amount, discount, po_number,
+  currency, payment_terms, verification_status, file_path, extracted_at, created_at,
+  updated_at, line_items, file_name
+"""
+
+
+# Name-detection prompt, frozen at module load; only {user_input} is substituted per call
+_DETECT_PROMPT_TEMPLATE = """
+You are an expert SQL assistant specialized in understanding user queries and mapping them exactly to database schema elements.
+
+User input:
+\"\"\"{user_input}\"\"\"
+""" + _SCHEMA_PROMPT_FRAGMENT + """
+Your task:
+
+- Analyze the user input and exactly identify if it explicitly mentions any of the following:
+  1. The database name (must be `Task` or `null`)
+  2. The main table name (must be `Invoice_Data` or `null`)
+  3. An exact column name from the columns listed above (or `null` if none mentioned)
+
+- If the user input references synonyms or common terms related to columns (e.g., "total revenue" relates to `total_amount`), you may map accordingly only if the mention is clear.
+
+- If there is ambiguity or no explicit mention of any database, table, or column name, return `null` for those fields.
+
+Important:
+
+- Do NOT guess or invent names.
+- Only respond with the JSON dictionary below WITHOUT ANY additional text or explanation.
+
+Example output JSON:
+
+{
+  "database": "Task",
+  "table": "Invoice_Data",
+  "column": "total_amount"
+}
+
+If nothing matches explicitly, return:
+
+{
+  "database": null,
+  "table": null,
+  "column": null
+}
+"""
+
+# Few-shot prompt for SQL generation, frozen at module load. Tokens are
+# substituted with str.replace so the JSON example's braces stay literal -
+# as an f-string, Python evaluated that block as a tuple-of-dicts expression
+# and the LLM saw its repr instead of the intended JSON.
+_SQL_PROMPT_TEMPLATE = """
+You are an expert SQL generator.
+
+The user wants to run a query on the database `{db_name}`, table `{table_name}`.
+
+Columns in the table: {columns}{schema_info}
+
+User input or question:
+\"\"\"{user_input}\"\"\"
+
+Instructions:
+- Always generate a **valid MySQL query**.
+- Use fully qualified table names like `{db_name}.{table_name}`.
+- Use the exact column names from the table.
+- Do not include explanations—only return the SQL query.
+- If the user mentions "total revenue" or "total amount", interpret it as the `total_amount` column.
+- If the user mentions "products" or "product", this refers to the `description` field inside the JSON array in the `line_items` column.
+- Emit literal comparison values (organization names, numbers, dates) as `%s` placeholders and list the concrete values as a JSON array on a final line labeled `PARAMS:`, for example:
+  SELECT SUM(CAST(total_amount AS DECIMAL(18,2))) FROM {db_name}.{table_name} WHERE billing_organization_name = %s;
+  PARAMS: ["UNIWARE SYSTEMS PVT LTD"]
+  If the query contains no literal values, omit the PARAMS line.
+
+Examples:
+
+> User: Who are the top 5 customers by total amount?  
+SELECT billing_organization_name, SUM(CAST(total_amount AS DECIMAL(18,2))) AS total_amount_sum
+FROM {db_name}.{table_name}
+GROUP BY billing_organization_name
+ORDER BY total_amount_sum DESC
+LIMIT 5;
+
+ 
+
+> User: What are the invoices in March month?
+SELECT *
+FROM {db_name}.{table_name}
+WHERE MONTH(invoice_date) = 3;
+
+
+> User: Total invoice amount of UNIWARE SYSTEMS PVT LTD organization?
+SELECT SUM(CAST(total_amount AS DECIMAL(18,2)))
+FROM {db_name}.{table_name}
+WHERE billing_organization_name = 'UNIWARE SYSTEMS PVT LTD';
+
+
+> User: Show me the highest total amount invoice customer.
+SELECT billing_organization_name, invoice_number, total_amount
+FROM {db_name}.{table_name}
+ORDER BY CAST(total_amount AS DECIMAL(18,2)) DESC
+LIMIT 1;
+
+
+
+> User: Summarize the table
+SELECT * FROM {db_name}.{table_name};
+
+
+
+If the `line_items` column contains an array of JSON objects like:
+
+[
+{
+  {
+    "S.NO": 1,
+    "description": "AMC of DELL EMC Data Domain 6300 – Renewal",
+    "quantity": 1,
+    "unit_price": 550000.00,
+    "total_per_product": 550000.00
+  },
+  {
+    "S.NO": 2,
+    "description": "Uniware Support for One Year – Uniware 8/5 On-Demand Remote Support",
+    "quantity": 1,
+    "unit_price": 40000.00,
+    "total_per_product": 40000.00
+  }
+
+  }
+]
+
+Example:
+"Which product appears in the most invoices?"
+SELECT
+items.description AS product,
+COUNT(DISTINCT id) AS invoice_count
+FROM {db_name}.{table_name},
+JSON_TABLE(
+line_items,
+'$[*]' COLUMNS (
+description VARCHAR(255) PATH '$.description'
+)
+) AS items
+GROUP BY items.description
+ORDER BY invoice_count DESC
+LIMIT 1;
+
+ 
+
+Example:
+"What is the total quantity sold for each product?"
+SELECT
+items.description AS product,
+SUM(CAST(items.quantity AS UNSIGNED)) AS total_quantity_sold
+FROM {db_name}.{table_name},
+JSON_TABLE(
+line_items,
+'$[*]' COLUMNS (
+description VARCHAR(255) PATH '$.description',
+quantity VARCHAR(50) PATH '$.quantity'
+)
+) AS items
+GROUP BY items.description
+ORDER BY total_quantity_sold DESC;
+
+ 
+
+Based on these examples and rules, generate only the appropriate SQL query for the given user input.
+
+
+"""
+
+_METADATA_TTL = 300  # seconds - schema barely changes, so metadata queries are memoized
+
+
+def ttl_cache(ttl):
+    """
+    lru_cache with a time-to-live: the current epoch (monotonic time // ttl)
+    is folded into the cache key, so entries expire when the epoch rolls over.
+    """
+    def decorator(func):
+        @lru_cache(maxsize=128)
+        def _cached(epoch, *args):
+            return func(*args)
+
+        @wraps(func)
+        def wrapper(*args):
+            return _cached(int(time.monotonic() // ttl), *args)
+
+        wrapper.cache_clear = _cached.cache_clear
+        return wrapper
+    return decorator
+
+
+def _invalidate_metadata_caches():
+    """Drop all memoized metadata - called when MySQL reports an unknown table/database."""
+    fetch_all_databases.cache_clear()
+    _cached_table_schema.cache_clear()
+
+
+@ttl_cache(_METADATA_TTL)
+def _cached_table_schema(db_name, table_name):
+    """Memoized get_table_schema - avoids a metadata round-trip per query build."""
+    return get_table_schema(db_name, table_name)
+
+
+@ttl_cache(_METADATA_TTL)
+def fetch_all_databases():
+    """
+    Fetches the list of all database names from MySQL server.
+    Returns list like ['information_schema', 'mysql', 'PO_APP', 'Task', ...]
+    """
+    try:
+        result = mysql_query("SHOW DATABASES;")
+        if result and "rows" in result:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Available databases: %s", [row[0] for row in result["rows"]])
+            return [row[0] for row in result["rows"]]
+    except Exception as e:
+        logging.error(f"Error fetching databases: {e}")
+    # Fallback to env default only if failed
+    return [os.getenv("MYSQL_DATABASE")]
+
+
+def detect_and_normalize_names(user_input, available_dbs):
+    """
+    This uses Watsonx LLM to identify and normalize database name, table name, and column names
+    based on user input and available databases/tables.
+
+    Returns a dict: {
+      "database": <exact_db_name>,
+      "table": <exact_table_name>,
+      "column": <exact_column_name or None>
+    }
+    """
+#     prompt = f"""
+# You are an expert SQL assistant.
+
+# User input:
+# \"\"\"{user_input}\"\"\"
+
+# Available database: Task
+# Available table in Task: Invoice_Data
+# Invoice_Data table columns: id, billing_organization_name, billing_address, billing_contact_information, billing_phone_number, billing_gst_number, billing_hsn_number, shipping_organization_name, shipping_address, shipping_contact_information, shipping_phone_number, shipping_gst_number, shipping_hsn_number, invoice_number, invoice_date, due_date, total_amount, subtotal, tax_amount, discount, po_number, currency, payment_terms, verification_status, file_path, extracted_at, created_at, updated_at, line_items, file_name
+
+# Please identify exactly:
+# - The database name (choose from "Task" or null if none specified)
+# - The main table name (choose from "Invoice_Data" or null if none specified)
+# - The exact column name in Invoice_Data if mentioned; otherwise null
+
+# If the user input is ambiguous or does not explicitly refer to any, return null for those fields.
+
+# Return ONLY this JSON dictionary with keys "database", "table", and "column", for example:
+
+# {{
+#   "database": ...,
+#   "table": ...,
+#   "column": ...
+# }}
+# """
+
+    prompt = _DETECT_PROMPT_TEMPLATE.replace("{user_input}", user_input)
+
+
+
+    # Detection only returns a tiny JSON dict - decode time is roughly linear in
+    # generated tokens, so don't pay for the 512-token budget the SQL call needs
+    response = watsonx_client.generate_text(prompt, max_new_tokens=64)
+
+    logging.info(f"Name detection LLM response: {response}")
+
+    # Parse JSON out of response safely
+    try:
+        detected = _json_loads(response)
+    except Exception:
+        # Attempt to extract JSON substring fallback
+        try:
+            detected = _json_loads(_JSON_OBJ_RE.search(response).group(0))
+        except Exception as e:
+            logging.error(f"Could not parse LLM JSON response: {e}")
+            detected = {"database": None, "table": None, "column": None}
+
+    return detected
+
+
+def build_full_sql_query(user_input, db_name, table_name, column_name=None):
+    """
+    Build a valid SQL query string by instructing Watsonx LLM
+    using exact database/table/column names previously predicted.
+    If column_name is given, build a query accordingly (for column info or aggregations).
+    If not, try to generate a sensible query for the input and known schema.
+
+    Returns (sql, params): literal values arrive as %s placeholders plus a bind
+    tuple, so MySQL sees the same statement text across users and can reuse its
+    parse/plan instead of re-planning every literal variant.
+    """
+    # Get columns info for given database & table to improve prompt
+    columns = []
+    if db_name and table_name:
+        columns = _cached_table_schema(db_name, table_name)
+
+    schema_info = ""
+    if columns:
+        schema_info = f"\nTable `{table_name}` columns: {', '.join(columns)}"
+
+#     prompt = f"""
+# You are an expert SQL generator.
+
+# The user wants to run a query on the database `{db_name}`, table `{table_name}`.
+
+# Columns in the table: {', '.join(columns)}{schema_info}
+
+# User input or question:
+# \"\"\"{user_input}\"\"\"
+
+# Instructions:
+# - Always generate a **valid MySQL query**.
+# - Use fully qualified table names like `{db_name}.{table_name}`.
+# - Use the exact column names from the table.
+# - Do not include explanations—only return the SQL query.
+# - If the user mentions "total revenue", interpret it as the `total_amount` column.
+# - if the user mention 'products' means this will be line_item description present in the line_item array.
+
+# Examples:
+
+# > User: Who are the top 5 customers by total amount?  
+# ```sql
+# SELECT org_name, SUM(CAST(total_amount AS FLOAT)) AS total_amount_sum
+# FROM Task.Invoice_Data
+# GROUP BY org_name
+# ORDER BY total_amount_sum DESC
+# LIMIT 5;
+# User: What are the invoices in March month?
+
+ 
+# SELECT *
+# FROM Task.Invoice_Data
+# WHERE MONTH(invoice_date) = 3;
+# User: Total invoice amount of UNIWARE SYSTEMS PVT LTD organization?
+
+ 
+# SELECT SUM(CAST(total_amount AS FLOAT))
+# FROM Task.Invoice_Data
+# WHERE org_name = 'UNIWARE SYSTEMS PVT LTD';
+# User: Show me the highest total amount invoice customer.
+
+ 
+# SELECT org_name, invoice_number, total_amount
+# FROM Task.Invoice_Data
+# ORDER BY CAST(total_amount AS FLOAT) DESC
+# LIMIT 1;
+# User: Summarize the table
+# SELECT * FROM Task.Invoice_Data;
+# If the line_items column contains an array of JSON objects like:
+
+
+# [
+#  { {
+#     "s_no": 1,
+#     "description": "AMC of DELL EMC Data Domain 6300 – Renewal",
+#     "quantity": 1,
+#     "unit_price": 550000.00,
+#     "total_per_product": 550000.00
+#   },
+#   {
+#     "s_no": 2,
+#     "description": "Uniware Support for One Year – Uniware 8/5 On-Demand Remote Support",
+#     "quantity": 1,
+#     "unit_price": 40000.00,
+#     "total_per_product": 40000.00
+#   }
+# }
+#   ]
+
+
+# Example
+# "Which product appears in the most invoices?"
+
+ 
+# SELECT 
+#   description AS product,
+#   COUNT(DISTINCT id) AS invoice_count
+# FROM Task.Invoice_Data,
+#   JSON_TABLE(
+#     line_items,
+#     '$[*]' COLUMNS (
+#       description VARCHAR(255) PATH '$.description'
+#     )
+#   ) AS items
+# GROUP BY description
+# ORDER BY invoice_count DESC
+# LIMIT 1;
+# "What is the total quantity sold for each product?
+
+# Based on these examples and rules, generate only the appropriate SQL query for the given user input.
+# """
+    prompt = (_SQL_PROMPT_TEMPLATE
+              .replace("{user_input}", user_input)
+              .replace("{db_name}", str(db_name))
+              .replace("{table_name}", str(table_name))
+              .replace("{columns}", ", ".join(columns))
+              .replace("{schema_info}", schema_info))
+    if column_name:
+        prompt += f"\nThe user specifically mentioned a column `{column_name}` that may be in the query."
+
+    response = watsonx_client.generate_text(prompt)
+    logging.info(f"Generated SQL from LLM: {response}")
+
+    # Extract SQL (naive - look for SQL code or from first SQL keyword)
+    sql_query, params = _split_sql_params(extract_sql_from_llm_response(response))
+    logger.debug("Extracted SQL: %s params: %s", sql_query, params)
+    return sql_query, params
+
+
+def extract_sql_from_llm_response(response_text):
+    """
+    Extract SQL from the LLM response by locating code blocks or starting at SQL keywords.
+    """
+    # Look for code block fenced by backticks - search stops at the first fence
+    # instead of scanning the whole response for every match
+    fence = _CODEBLOCK_RE.search(response_text)
+    if fence:
+        return fence.group(1).strip()
+
+    # Otherwise find first SQL keyword and return from there
+    match = _SQL_KW_RE.search(response_text)
+    if match:
+        return response_text[match.start():].strip()
+
+    # fallback: return full response
+    return response_text.strip()
+
+
+# Precomputed SQL for the example questions shipped in the Gradio UI - clicking
+# one short-circuits straight to MySQL instead of paying two LLM calls.
+_CANNED_SQL = {
+    "Who are the top 5 customers by total amount?":
+        "SELECT billing_organization_name, SUM(CAST(total_amount AS DECIMAL(18,2))) AS total_amount_sum "
+        "FROM Task.Invoice_Data GROUP BY billing_organization_name ORDER BY total_amount_sum DESC LIMIT 5;",
+    "What are the invoices in July month?":
+        "SELECT * FROM Task.Invoice_Data WHERE MONTH(invoice_date) = 7;",
+    "Total invoice amount of UNIWARE SYSTEMS PVT LTD organization":
+        "SELECT SUM(CAST(total_amount AS DECIMAL(18,2))) AS total_invoice_amount "
+        "FROM Task.Invoice_Data WHERE billing_organization_name = 'UNIWARE SYSTEMS PVT LTD';",
+    "Show me the highest total amount invoice customer":
+        "SELECT billing_organization_name, invoice_number, total_amount "
+        "FROM Task.Invoice_Data ORDER BY CAST(total_amount AS DECIMAL(18,2)) DESC LIMIT 1;",
+    "How many customers do we have?":
+        "SELECT COUNT(DISTINCT billing_organization_name) AS customer_count FROM Task.Invoice_Data;",
+}
+
+_PUNCT_RE = re.compile(r"[^\w\s]")
+
+
+def _normalize_canned(text):
+    """Lowercase, strip punctuation and collapse whitespace for canned-SQL lookup."""
+    return _WS_RE.sub(" ", _PUNCT_RE.sub("", text)).strip().lower()
+
+
+_CANNED_SQL_NORM = {_normalize_canned(k): v for k, v in _CANNED_SQL.items()}
+
+_DEFAULT_ROW_LIMIT = 200
+_LIMIT_RE = re.compile(r"\blimit\s+\d+", re.IGNORECASE)
+_AGGREGATE_RE = re.compile(r"\b(count|sum|avg|min|max|group\s+by)\b", re.IGNORECASE)
+
+# Pre-compiled once at import time - these run on every LLM response / SQL error
+_CODEBLOCK_RE = re.compile(r"```(?:sql)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+_SQL_KW_RE = re.compile(r"\b(SELECT|INSERT|UPDATE|DELETE|WITH|SHOW|DESCRIBE|EXPLAIN)\b", re.IGNORECASE)
+_UNKNOWN_COL_RE = re.compile(r"Unknown column '(.+?)' in")
+_PARAMS_LABEL_RE = re.compile(r"\bPARAMS\s*:\s*(\[.*?\])", re.DOTALL | re.IGNORECASE)
+_JSON_OBJ_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+
+def _split_sql_params(sql_text):
+    """
+    Split an extracted 'SELECT ... %s ... PARAMS: [...]' block into
+    (sql, params tuple). Responses without a PARAMS line yield empty params.
+    """
+    match = _PARAMS_LABEL_RE.search(sql_text)
+    if not match:
+        return sql_text.strip(), ()
+    sql = sql_text[:match.start()].strip()
+    try:
+        params = tuple(json.loads(match.group(1)))
+    except Exception as e:
+        logging.warning(f"Could not parse PARAMS line from LLM response: {e}")
+        return sql, ()
+    return sql, params
+
+
+def _execute_sql(sql_query, db_name, params=()):
+    """Run a query through MCP, passing bind parameters only when present."""
+    if params:
+        return mysql_query(sql_query, params=params, db_name=db_name)
+    return mysql_query(sql_query, db_name=db_name)
+
+
+_EXPLAIN_ROW_THRESHOLD = 100000
+
+
+@lru_cache(maxsize=256)
+def _explain_ok(sql_query, db_name, params=()):
+    """
+    Cheap safety net before executing LLM-generated SQL: run EXPLAIN and
+    reject plans that full-scan (type ALL) past _EXPLAIN_ROW_THRESHOLD rows -
+    e.g. an accidental Cartesian product over the line_items JSON_TABLE.
+    Identical queries have identical plans within a schema version, so the
+    verdict is memoized. Fails open if EXPLAIN itself errors - the real
+    execution will surface the problem.
+    """
+    if not sql_query.lstrip().upper().startswith("SELECT"):
+        return True
+    try:
+        explain = _execute_sql("EXPLAIN " + sql_query, db_name, params)
+        columns = explain.get("columns") or []
+        type_idx = columns.index("type")
+        rows_idx = columns.index("rows")
+        for row in explain.get("rows") or []:
+            if row[type_idx] == "ALL" and int(row[rows_idx] or 0) > _EXPLAIN_ROW_THRESHOLD:
+                return False
+    except Exception as e:
+        logging.warning(f"EXPLAIN check skipped: {e}")
+    return True
+
+
+def _inject_limit(sql, limit=_DEFAULT_ROW_LIMIT, offset=0):
+    """
+    Cap the result set before execution: the UI only ever shows 20 rows, so
+    transferring an unbounded SELECT is wasted MySQL work and network bytes.
+    Queries that already carry a LIMIT, and aggregate queries (COUNT/SUM/...,
+    GROUP BY) which are small by construction, are left alone.
+    """
+    if _LIMIT_RE.search(sql):
+        return sql
+    if _AGGREGATE_RE.search(sql):
+        return sql
+    sql = sql.rstrip().rstrip(";")
+    if offset:
+        return f"{sql} LIMIT {limit} OFFSET {offset};"
+    return f"{sql} LIMIT {limit};"
+
+
+def extract_column_from_sql_error(error_msg):
+    """
+    Extract unknown column name from MySQL error message.
+    """
+    matches = _UNKNOWN_COL_RE.findall(error_msg)
+    if matches:
+        return matches[0]
+    return None
+
+
+def fix_sql_query_column(sql, error_msg, db_name, table_name):
+    """
+    Attempt to fix SQL by replacing unknown column with closest matching column in actual schema.
+    """
+    invalid_col = extract_column_from_sql_error(error_msg)
+    if not invalid_col:
+        return None
+
+    columns = _cached_table_schema(db_name, table_name)
+    if not columns:
+        return None
+
+    # Common case first: the invalid name differs only by case or underscores -
+    # resolve it with an O(1) dict lookup before any fuzzy matching
+    norm_map = {c.lower().replace("_", ""): c for c in columns}
+    corrected_col = norm_map.get(invalid_col.lower().replace("_", ""))
+
+    if corrected_col is None:
+        if _rf_process is not None:
+            match = _rf_process.extractOne(invalid_col, columns, scorer=_rf_fuzz.WRatio, score_cutoff=60)
+            if match:
+                corrected_col = match[0]
+        else:
+            matches = get_close_matches(invalid_col, columns, n=1, cutoff=0.6)
+            if matches:
+                corrected_col = matches[0]
+
+    if corrected_col is None:
+        return None
+
+    fixed_sql = re.sub(re.escape(invalid_col), corrected_col, sql, flags=re.IGNORECASE)
+    logger.debug("fixed_sql: %s", fixed_sql)
+    return fixed_sql
+
+
+def _build_and_execute(user_input, skeleton, values, db_name, table_name, column_name, page):
+    """
+    Generate (or fetch from the template cache) the SQL for the given exact
+    names, execute it and auto-fix unknown-column errors once. Returns the
+    same response dict shape as handle_user_query.
+    """
+    cached_sql = _sql_from_cache(skeleton, values, db_name, table_name, column_name)
+    sql_cache_hit = cached_sql is not None
+    if sql_cache_hit:
+        sql_query, params = cached_sql
+    else:
+        try:
+            sql_query, params = build_full_sql_query(user_input, db_name=db_name, table_name=table_name, column_name=column_name)
+        except Exception as e:
+            logging.error(f"Error generating SQL query: {e}")
+            return {"error": f"AI generation failed: {str(e)}"}
+    logging.info(f"cache_hit={sql_cache_hit} for SQL template (skeleton: {skeleton})")
+
+    # Cap unbounded SELECTs before they hit MySQL. The template is only cached
+    # after a successful execution (below), so a bad generation can't poison
+    # every structurally similar question; raw_sql keeps the limit-free form.
+    raw_sql = sql_query
+    sql_query = _inject_limit(sql_query, offset=page * _DEFAULT_ROW_LIMIT)
+
+    # Refuse pathological plans before they can hang the connection
+    if not _explain_ok(sql_query, db_name, params):
+        logging.warning(f"Rejected SQL after EXPLAIN check:\n{sql_query}")
+        return {
+            "error": "Query rejected: its execution plan full-scans too many rows. Please narrow the question.",
+            "sql": sql_query
+        }
+
+    # Step 4: Try executing the query (recent identical queries come from the result cache)
+    cached_result = _result_from_cache(sql_query, db_name, params)
+    if cached_result is not None:
+        logging.info(f"cache_hit=True for result set (db: {db_name})")
+        return {
+            "sql": sql_query,
+            "result": cached_result,
+            "corrected": False,
+            "database": db_name,
+            "table": table_name,
+            "column": column_name
+        }
+    try:
+        result = _execute_sql(sql_query, db_name, params)
+        _store_result(sql_query, db_name, result, params)
+        if not sql_cache_hit:
+            _store_sql_template(skeleton, values, db_name, table_name, column_name, raw_sql, params)
+        return {
+            "sql": sql_query,
+            "result": result,
+            "corrected": False,
+            "database": db_name,
+            "table": table_name,
+            "column": column_name
+        }
+    except Exception as exec_err:
+        error_msg = str(exec_err)
+        logging.warning(f"Query execution failed: {error_msg}")
+
+        # Memoized metadata may be stale if the schema changed under us
+        if "Unknown table" in error_msg or "Unknown database" in error_msg:
+            _invalidate_metadata_caches()
+
+        # Step 5: Try to auto-fix unknown column errors once. The fix is applied
+        # to the limit-free SQL so the corrected template can be cached; the
+        # executed form gets the LIMIT re-injected.
+        fixed_sql = fix_sql_query_column(raw_sql, error_msg, db_name, table_name)
+        if fixed_sql and fixed_sql != raw_sql:
+            fixed_query = _inject_limit(fixed_sql, offset=page * _DEFAULT_ROW_LIMIT)
+            logging.info(f"Retrying with fixed SQL:\n{fixed_query}")
+            try:
+                fixed_result = _execute_sql(fixed_query, db_name, params)
+                # Cache the corrected SQL (overwriting any stale template) so
+                # repeats don't re-run the broken query first
+                _store_sql_template(skeleton, values, db_name, table_name, column_name, fixed_sql, params)
+                return {
+                    "sql": fixed_query,
+                    "result": fixed_result,
+                    "corrected": True,
+                    "original_sql": sql_query,
+                    "database": db_name,
+                    "table": table_name,
+                    "column": column_name
+                }
+            except Exception as second_err:
+                logging.error(f"Execution failed even after fix: {second_err}")
+                return {"error": f"Execution failed after fix: {second_err}", "sql": fixed_query}
+
+        # If no fix possible, return original error
+        logger.debug("Execution failed: %s (original SQL: %s)", error_msg, sql_query)
+        return {"error": f"Query execution error: {error_msg}", "sql": sql_query}
+
+
+def handle_user_query(user_input, page=0):
+    """
+    Main entry point.
+
+    Logic:
+    1. Known example questions go straight to MySQL via canned SQL.
+    2. Generate SQL with a single LLM call against the default Task.Invoice_Data
+       target - the SQL-gen prompt already encodes the whole schema, so the
+       separate name-detection call is unnecessary in the common case.
+    3. Execute (with one unknown-column auto-fix attempt).
+    4. Only if that fails, fall back to the two-call path: detect exact
+       database/table/column names with the LLM and regenerate.
+
+    `page` supports a "show more" flow: re-running the same input with page=1, 2, ...
+    fetches the next LIMIT-sized slice via OFFSET.
+    """
+
+    logging.info(f"Received user input: {user_input}")
+
+    # Step 0: Known example questions skip the LLM pipeline entirely
+    canned_sql = _CANNED_SQL.get(user_input.strip()) or _CANNED_SQL_NORM.get(_normalize_canned(user_input))
+    if canned_sql:
+        logging.info("cache_hit=True for canned example query")
+        default_db = os.getenv("MYSQL_DATABASE")
+        sql_query = _inject_limit(canned_sql, offset=page * _DEFAULT_ROW_LIMIT)
+        try:
+            result = mysql_query(sql_query, db_name=default_db)
+            return {
+                "sql": sql_query,
+                "result": result,
+                "corrected": False,
+                "database": default_db,
+                "table": "Invoice_Data",
+                "column": None
+            }
+        except Exception as e:
+            # Fall through to the normal pipeline - the LLM may still produce a working query
+            logging.warning(f"Canned SQL failed, falling back to LLM pipeline: {e}")
+
+    # Step 1: One LLM call against the default target
+    default_db = os.getenv("MYSQL_DATABASE")
+    skeleton, values = _query_skeleton(user_input)
+    response = _build_and_execute(user_input, skeleton, values, default_db, "Invoice_Data", None, page)
+    if "error" not in response:
+        return response
+
+    # Step 2 (fallback): the default-target SQL failed and wasn't auto-fixable,
+    # so pay for the name-detection call and retry with the exact names
+    available_dbs = fetch_all_databases()
+    detected = _detect_cached(_normalize_input(user_input), tuple(available_dbs))
+    db_name = detected.get("database") or default_db
+    table_name = detected.get("table") or "Invoice_Data"
+    column_name = detected.get("column")
+
+    # Security fallback & logging
+    if db_name not in available_dbs:
+        logging.warning(f"Detected DB '{db_name}' not in available databases list; falling back to default")
+        db_name = default_db
+
+    if (db_name, table_name, column_name) == (default_db, "Invoice_Data", None):
+        # Detection agrees with the target we already tried - nothing new to run
+        return response
+
+    logging.info(f"Retrying with detected names - DB: {db_name}, Table: {table_name}, Column: {column_name}")
+    retry = _build_and_execute(user_input, skeleton, values, db_name, table_name, column_name, page)
+    return retry if "error" not in retry else response
+
+
+async def handle_user_query_async(user_input, page=0):
+    """
+    Async entry point for the Gradio handler.
+
+    The Watsonx and MySQL calls are blocking, so the whole pipeline runs on a
+    worker thread via run_in_executor - the event loop stays free to serve
+    other chats while this turn waits on the LLM or the database.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, handle_user_query, user_input, page)